@@ -1,160 +1,601 @@
 import os
+import atexit
+import collections
+import contextlib
+import multiprocessing
+import queue
 import sqlite3
+import threading
+import time
+from functools import lru_cache
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 import pdfplumber
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import pypdfium2 as pdfium
+import numpy as np
+import scipy.sparse
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.pipeline import make_pipeline
 import requests
+from cachetools import TTLCache
 import pyttsx3
 from duckduckgo_search import DDGS
-from flask import Flask, request, jsonify
+import orjson
+from flask import Flask, Response, request
 
 app = Flask(__name__)
 
+REFIT_EVERY = 500
+HASHING_FEATURES = 2 ** 18
+ASK_CACHE_SIZE = 1024
+DDG_CACHE_SIZE = 512
+DDG_CACHE_TTL = 86400
+DDG_TIMEOUT = 5
+DDG_MAX_WORKERS = 16
+PARALLEL_PDF_MIN_PAGES = 4
+PDF_PAGES_PER_TASK = 4
+FETCH_BATCH_SIZE = 1000
+INGEST_BATCH_SIZE = 1000
+
+_pdfium_lock = threading.Lock()
+_pdf_executor = None
+_pdf_executor_lock = threading.Lock()
+
+_HASHER = HashingVectorizer(n_features=HASHING_FEATURES, alternate_sign=False, norm=None, dtype=np.float32)
+
+def _encode_counts(counts, row):
+    start, end = counts.indptr[row], counts.indptr[row + 1]
+    return (counts.indices[start:end].astype(np.int32).tobytes()
+            + counts.data[start:end].astype(np.float32).tobytes())
+
+def _decode_counts(blob):
+    n = len(blob) // 8
+    return np.frombuffer(blob, np.int32, n), np.frombuffer(blob, np.float32, n, offset=4 * n)
+
+def _hash_contents(hashes, texts, start):
+    for i, text in enumerate(texts, start):
+        hashes.setdefault(hash(text.strip().lower()), i)
+
+def _pdf_lock(use_table_mode=False):
+    return contextlib.nullcontext() if use_table_mode else _pdfium_lock
+
+def _open_pdf(pdf_path, use_table_mode=False):
+    with _pdf_lock(use_table_mode):
+        return pdfplumber.open(pdf_path) if use_table_mode else pdfium.PdfDocument(pdf_path)
+
+def _close_pdf(pdf, use_table_mode=False):
+    with _pdf_lock(use_table_mode):
+        pdf.close()
+
+def _iter_pages(pdf, start, stop, use_table_mode=False):
+    if use_table_mode:
+        for i in range(start, stop):
+            yield pdf.pages[i].extract_text()
+        return
+    for i in range(start, stop):
+        with _pdfium_lock:
+            page = pdf[i]
+            textpage = page.get_textpage()
+            text = textpage.get_text_range()
+            textpage.close()
+            page.close()
+        yield text
+
+def _extract_pages(pdf_path, start, stop, use_table_mode=False):
+    pdf = _open_pdf(pdf_path, use_table_mode)
+    try:
+        return list(_iter_pages(pdf, start, stop, use_table_mode))
+    finally:
+        _close_pdf(pdf, use_table_mode)
+
+def _pdf_pool_size():
+    web_workers = max(1, int(os.environ.get("WEB_CONCURRENCY", 1)))
+    return max(1, (os.cpu_count() or 1) // web_workers)
+
+def _get_pdf_executor():
+    global _pdf_executor
+    if _pdf_executor is None:
+        with _pdf_executor_lock:
+            if _pdf_executor is None:
+                methods = multiprocessing.get_all_start_methods()
+                context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                _pdf_executor = ProcessPoolExecutor(max_workers=_pdf_pool_size(), mp_context=context)
+    return _pdf_executor
+
+def _reset_pdf_executor(executor):
+    global _pdf_executor
+    with _pdf_executor_lock:
+        if _pdf_executor is executor:
+            _pdf_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def _extract_pdf_text(pdf_path, use_table_mode=False):
+    pdf = _open_pdf(pdf_path, use_table_mode)
+    try:
+        with _pdf_lock(use_table_mode):
+            n_pages = len(pdf.pages) if use_table_mode else len(pdf)
+        if n_pages < PARALLEL_PDF_MIN_PAGES or _pdf_pool_size() < 2:
+            yield from _iter_pages(pdf, 0, n_pages, use_table_mode)
+            return
+    finally:
+        _close_pdf(pdf, use_table_mode)
+    executor = _get_pdf_executor()
+    window = 2 * _pdf_pool_size()
+    pending = collections.deque()
+    try:
+        for start in range(0, n_pages, PDF_PAGES_PER_TASK):
+            stop = min(start + PDF_PAGES_PER_TASK, n_pages)
+            pending.append(executor.submit(_extract_pages, pdf_path, start, stop, use_table_mode))
+            if len(pending) >= window:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    except BrokenProcessPool:
+        _reset_pdf_executor(executor)
+        raise
+    finally:
+        for future in pending:
+            future.cancel()
+
+def _iter_pdf_chunks(pdf_path, use_table_mode=False):
+    for text in _extract_pdf_text(pdf_path, use_table_mode):
+        if text:
+            for line in text.splitlines():
+                chunk = line.strip()
+                if chunk:
+                    yield chunk
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
 class HybridAI:
     def __init__(self, db_path="hybrid_ai_v2.db"):
         self.db_path = db_path
+        self._local = threading.local()
+        self._conns = []
+        self._conns_lock = threading.Lock()
+        atexit.register(self.close)
         self._init_db()
-        self.vectorizer = TfidfVectorizer()
+        self._index_lock = threading.Lock()
+        self._refit_lock = threading.Lock()
+        self._state = None
+        self._refit_index()
+        self._ask_cached = lru_cache(maxsize=ASK_CACHE_SIZE)(self._ask_impl)
+        self._ddg_cache = TTLCache(maxsize=DDG_CACHE_SIZE, ttl=DDG_CACHE_TTL)
+        self._ddg_cache_lock = threading.Lock()
+        self._ddg_executor = ThreadPoolExecutor(max_workers=DDG_MAX_WORKERS)
+        self._ddg_local = threading.local()
         self.tts_enabled = False
-        self.engine = pyttsx3.init()
+        self.engine = None
+        self._tts_thread = None
+        self._tts_failed = False
+        self._tts_ready = threading.Event()
+        self._tts_lock = threading.Lock()
+        self._tts_q = queue.Queue()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA temp_store=MEMORY")
+            conn.execute("PRAGMA cache_size=-64000")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def close(self):
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
 
     def _init_db(self):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        c = self._conn().cursor()
         c.execute('''CREATE TABLE IF NOT EXISTS memory
-                     (id INTEGER PRIMARY KEY, source TEXT, content TEXT)''')
+                     (id INTEGER PRIMARY KEY, source TEXT, content TEXT, vec BLOB)''')
+        c.execute("PRAGMA table_info(memory)")
+        if "vec" not in [row[1] for row in c.fetchall()]:
+            c.execute("ALTER TABLE memory ADD COLUMN vec BLOB")
         c.execute('''CREATE TABLE IF NOT EXISTS pdf_files
                      (id INTEGER PRIMARY KEY, filename TEXT)''')
-        conn.commit()
-        conn.close()
+        c.execute('''CREATE TABLE IF NOT EXISTS ddg_cache
+                     (query TEXT PRIMARY KEY, response TEXT, ts REAL)''')
+        c.execute("CREATE INDEX IF NOT EXISTS idx_ddg_cache_ts ON ddg_cache(ts)")
+        c.execute("CREATE INDEX IF NOT EXISTS idx_memory_source ON memory(source)")
+        c.execute('''CREATE TABLE IF NOT EXISTS memory_state
+                     (id INTEGER PRIMARY KEY CHECK (id = 0), inserted INTEGER, deleted INTEGER)''')
+        c.execute("INSERT OR IGNORE INTO memory_state (id, inserted, deleted) VALUES (0, 0, 0)")
+        c.execute('''CREATE TRIGGER IF NOT EXISTS memory_state_ai AFTER INSERT ON memory BEGIN
+                         UPDATE memory_state SET inserted = inserted + 1 WHERE id = 0;
+                     END''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS memory_state_ad AFTER DELETE ON memory BEGIN
+                         UPDATE memory_state SET deleted = deleted + 1 WHERE id = 0;
+                     END''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS memory_state_au AFTER UPDATE OF content ON memory BEGIN
+                         UPDATE memory_state SET deleted = deleted + 1 WHERE id = 0;
+                     END''')
+        self._init_fts(c)
+
+    def _init_fts(self, c):
+        c.execute("SELECT 1 FROM sqlite_master WHERE name='memory_fts'")
+        exists = c.fetchone() is not None
+        try:
+            c.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS memory_fts
+                         USING fts5(content, content='memory', content_rowid='id')''')
+        except sqlite3.OperationalError:
+            return
+        c.execute('''CREATE TRIGGER IF NOT EXISTS memory_ai AFTER INSERT ON memory BEGIN
+                         INSERT INTO memory_fts(rowid, content) VALUES (new.id, new.content);
+                     END''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS memory_ad AFTER DELETE ON memory BEGIN
+                         INSERT INTO memory_fts(memory_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                     END''')
+        c.execute('''CREATE TRIGGER IF NOT EXISTS memory_au AFTER UPDATE OF content ON memory BEGIN
+                         INSERT INTO memory_fts(memory_fts, rowid, content) VALUES ('delete', old.id, old.content);
+                         INSERT INTO memory_fts(rowid, content) VALUES (new.id, new.content);
+                     END''')
+        if not exists:
+            c.execute("INSERT INTO memory_fts(memory_fts) VALUES ('rebuild')")
 
     def _save_memory(self, source, content):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute("INSERT INTO memory (source, content) VALUES (?, ?)", (source, content))
-        conn.commit()
-        conn.close()
+        counts = _HASHER.transform([content])
+        c = self._conn().cursor()
+        c.execute("INSERT INTO memory (source, content, vec) VALUES (?, ?, ?)",
+                  (source, content, _encode_counts(counts, 0)))
+        self._sync_index()
+        self._ask_cached.cache_clear()
 
-    def _load_all_memory(self):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
-        c.execute("SELECT content FROM memory")
-        rows = c.fetchall()
-        conn.close()
-        return [row[0] for row in rows]
+    def _load_hashed_memory(self):
+        c = self._conn().cursor()
+        c.execute("SELECT id, content, vec FROM memory")
+        texts, indices, data, lengths, missing = [], [], [], [], []
+        while True:
+            rows = c.fetchmany(FETCH_BATCH_SIZE)
+            if not rows:
+                break
+            for row_id, content, vec in rows:
+                if vec is None:
+                    vec = _encode_counts(_HASHER.transform([content]), 0)
+                    missing.append((vec, row_id))
+                row_indices, row_data = _decode_counts(vec)
+                texts.append(content)
+                indices.append(row_indices)
+                data.append(row_data)
+                lengths.append(len(row_indices))
+        if not texts:
+            return texts, None, missing
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        counts = scipy.sparse.csr_matrix((np.concatenate(data), np.concatenate(indices), indptr),
+                                         shape=(len(texts), HASHING_FEATURES))
+        return texts, counts, missing
+
+    def _read_state(self, c):
+        c.execute("SELECT inserted, deleted FROM memory_state WHERE id = 0")
+        return c.fetchone()
+
+    def _refit_index(self):
+        with self._refit_lock:
+            conn = self._conn()
+            c = conn.cursor()
+            doc_matrix = None
+            vectorizer = None
+            c.execute("BEGIN")
+            try:
+                state = self._read_state(c)
+                if state == self._state:
+                    return
+                c.execute("SELECT COALESCE(MAX(id), 0) FROM memory")
+                max_id = c.fetchone()[0]
+                texts, doc_counts, missing = self._load_hashed_memory()
+            finally:
+                conn.commit()
+            if missing:
+                c.execute("BEGIN")
+                try:
+                    c.executemany("UPDATE memory SET vec=? WHERE id=?", missing)
+                except sqlite3.Error:
+                    conn.rollback()
+                    raise
+                conn.commit()
+            if doc_counts is not None:
+                idf = TfidfTransformer()
+                doc_matrix = idf.fit_transform(doc_counts).astype(np.float32, copy=False)
+                vectorizer = make_pipeline(_HASHER, idf)
+            doc_csc = doc_matrix.tocsc() if doc_matrix is not None else None
+            content_hashes = {}
+            _hash_contents(content_hashes, texts, 0)
+            with self._index_lock:
+                if self._state is not None and (state[0] < self._state[0] or state[1] < self._state[1]):
+                    return
+                self.vectorizer = vectorizer
+                self._doc_texts = texts
+                self._doc_csc = doc_csc
+                self._doc_tail = None
+                self._content_hashes = content_hashes
+                self._new_docs = 0
+                self._state = state
+                self._max_id = max_id
+
+    def _sync_index(self):
+        with self._index_lock:
+            conn = self._conn()
+            c = conn.cursor()
+            state = self._read_state(c)
+            if state == self._state:
+                return state
+            if state[1] == self._state[1] and state[0] - self._state[0] < REFIT_EVERY:
+                c.execute("BEGIN")
+                try:
+                    state = self._read_state(c)
+                    c.execute("SELECT id, content FROM memory WHERE id > ? ORDER BY id", (self._max_id,))
+                    rows = c.fetchall()
+                finally:
+                    conn.commit()
+                if state[1] == self._state[1] and (not rows or self._index_documents([row[1] for row in rows])):
+                    if rows:
+                        self._max_id = rows[-1][0]
+                    self._state = state
+                    return state
+        self._refit_index()
+        return self._state
+
+    def _index_documents(self, texts):
+        if self._doc_csc is None or self._new_docs + len(texts) >= REFIT_EVERY:
+            return False
+        new_vecs = self.vectorizer.transform(texts).astype(np.float32, copy=False)
+        if self._doc_tail is None:
+            self._doc_tail = new_vecs
+        else:
+            self._doc_tail = scipy.sparse.vstack([self._doc_tail, new_vecs], format="csr")
+        _hash_contents(self._content_hashes, texts, len(self._doc_texts))
+        self._doc_texts.extend(texts)
+        self._new_docs += len(texts)
+        return True
 
     def _search_local_memory(self, query):
-        memories = self._load_all_memory()
-        if not memories:
+        key = query.strip().lower()
+        with self._index_lock:
+            vectorizer = self.vectorizer
+            doc_texts = self._doc_texts
+            exact_index = self._content_hashes.get(hash(key))
+            doc_csc = self._doc_csc
+            doc_tail = self._doc_tail
+        if exact_index is not None and doc_texts[exact_index].strip().lower() == key:
+            return doc_texts[exact_index]
+        if doc_csc is None:
             return None
-        tfidf = self.vectorizer.fit_transform(memories + [query])
-        cosine_sim = cosine_similarity(tfidf[-1], tfidf[:-1]).flatten()
-        top_index = cosine_sim.argmax()
-        if cosine_sim[top_index] > 0.2:
-            return memories[top_index]
+        query_vec = vectorizer.transform([query]).astype(np.float32, copy=False)
+        if not query_vec.nnz:
+            return None
+        scores = doc_csc[:, query_vec.indices] @ query_vec.data
+        if doc_tail is not None:
+            scores = np.concatenate([scores, (doc_tail @ query_vec.T).toarray().ravel()])
+        top_index = scores.argmax()
+        if scores[top_index] > 0.2:
+            return doc_texts[top_index]
         return None
 
-    def ingest_pdf(self, pdf_path):
+    def ingest_pdf(self, pdf_path, use_table_mode=False):
         if not os.path.exists(pdf_path):
             return "PDF file not found."
-        text_chunks = []
+        source = f"pdf:{os.path.basename(pdf_path)}"
+        conn = self._conn()
+        c = conn.cursor()
+        c.execute("SELECT COALESCE(MAX(id), 0) FROM memory")
+        last_id = c.fetchone()[0]
+        count = 0
         try:
-            with pdfplumber.open(pdf_path) as pdf:
-                for page in pdf.pages:
-                    text = page.extract_text()
-                    if text:
-                        for chunk in text.split("\n"):
-                            if chunk.strip():
-                                text_chunks.append(chunk.strip())
+            for batch in _batched(_iter_pdf_chunks(pdf_path, use_table_mode), INGEST_BATCH_SIZE):
+                counts = _HASHER.transform(batch)
+                c.execute("BEGIN")
+                c.executemany("INSERT INTO memory (source, content, vec) VALUES (?, ?, ?)",
+                              ((source, chunk, _encode_counts(counts, i)) for i, chunk in enumerate(batch)))
+                conn.commit()
+                count += len(batch)
         except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            c.execute("DELETE FROM memory WHERE source=? AND id>?", (source, last_id))
+            if isinstance(e, sqlite3.Error):
+                raise
             return f"Error reading PDF: {e}"
-        for chunk in text_chunks:
-            self._save_memory(f"pdf:{os.path.basename(pdf_path)}", chunk)
         self._save_pdf_record(pdf_path)
-        return f"Ingested {len(text_chunks)} text chunks from {pdf_path}"
+        self._sync_index()
+        self._ask_cached.cache_clear()
+        return f"Ingested {count} text chunks from {pdf_path}"
 
     def _save_pdf_record(self, pdf_path):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        c = self._conn().cursor()
         c.execute("INSERT INTO pdf_files (filename) VALUES (?)", (os.path.basename(pdf_path),))
-        conn.commit()
-        conn.close()
+
+    def _get_cached_search(self, query):
+        with self._ddg_cache_lock:
+            if query in self._ddg_cache:
+                return self._ddg_cache[query]
+        c = self._conn().cursor()
+        c.execute("SELECT response, ts FROM ddg_cache WHERE query=?", (query,))
+        row = c.fetchone()
+        if not row:
+            return None
+        if time.time() - row[1] > DDG_CACHE_TTL:
+            c.execute("DELETE FROM ddg_cache WHERE query=?", (query,))
+            return None
+        with self._ddg_cache_lock:
+            self._ddg_cache[query] = row[0]
+        return row[0]
+
+    def _cache_search(self, query, response):
+        with self._ddg_cache_lock:
+            self._ddg_cache[query] = response
+        now = time.time()
+        c = self._conn().cursor()
+        c.execute("DELETE FROM ddg_cache WHERE ts < ?", (now - DDG_CACHE_TTL,))
+        c.execute("INSERT OR REPLACE INTO ddg_cache (query, response, ts) VALUES (?, ?, ?)",
+                  (query, response, now))
+
+    def _ddgs(self):
+        ddgs = getattr(self._ddg_local, "ddgs", None)
+        if ddgs is None:
+            ddgs = self._ddg_local.ddgs = DDGS()
+        return ddgs
+
+    def _fetch_online(self, query):
+        results = []
+        try:
+            for r in self._ddgs().text(query, max_results=3):
+                results.append(r.get("body") or r.get("title", ""))
+        except Exception:
+            self._ddg_local.ddgs = None
+            raise
+        return results
 
     def search_online(self, query):
+        cached = self._get_cached_search(query)
+        if cached is not None:
+            return cached
         try:
-            results = []
-            with DDGS() as ddgs:
-                for r in ddgs.text(query, max_results=3):
-                    results.append(r.get("body") or r.get("title", ""))
-            return " ".join(results) if results else None
+            results = self._ddg_executor.submit(self._fetch_online, query).result(timeout=DDG_TIMEOUT)
         except Exception:
             return None
+        if not results:
+            return None
+        response = " ".join(results)
+        self._cache_search(query, response)
+        return response
 
-    def ask(self, query):
+    def _ask_impl(self, query, state):
         local_answer = self._search_local_memory(query)
         if local_answer:
-            self._speak(local_answer)
             return local_answer
         online_answer = self.search_online(query)
         if online_answer:
             self._save_memory("online", online_answer)
-            self._speak(online_answer)
             return online_answer
-        return "Sorry, I couldn’t find an answer."
+        raise LookupError(query)
+
+    def ask(self, query):
+        try:
+            answer = self._ask_cached(query.strip().lower(), self._sync_index())
+        except LookupError:
+            return "Sorry, I couldn’t find an answer."
+        self._speak(answer)
+        return answer
 
     def say(self, text):
         self._save_memory("user", text)
         return "Noted and stored in memory."
 
     def list_memory(self):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        c = self._conn().cursor()
         c.execute("SELECT id, source, content FROM memory")
-        rows = c.fetchall()
-        conn.close()
-        return rows
+        return c.fetchall()
 
     def forget(self, memory_id):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        c = self._conn().cursor()
         c.execute("DELETE FROM memory WHERE id=?", (memory_id,))
-        conn.commit()
-        conn.close()
+        self._sync_index()
+        self._ask_cached.cache_clear()
         return f"Deleted memory with ID {memory_id}"
 
     def forget_pdf(self, pdf_id):
-        conn = sqlite3.connect(self.db_path)
+        conn = self._conn()
         c = conn.cursor()
         c.execute("SELECT filename FROM pdf_files WHERE id=?", (pdf_id,))
         row = c.fetchone()
         if not row:
-            conn.close()
             return f"No PDF found with ID {pdf_id}"
         filename = row[0]
-        c.execute("DELETE FROM memory WHERE source=?", (f"pdf:{filename}",))
-        c.execute("DELETE FROM pdf_files WHERE id=?", (pdf_id,))
+        c.execute("BEGIN")
+        try:
+            c.execute("DELETE FROM memory WHERE source=?", (f"pdf:{filename}",))
+            c.execute("DELETE FROM pdf_files WHERE id=?", (pdf_id,))
+        except sqlite3.Error:
+            conn.rollback()
+            raise
         conn.commit()
-        conn.close()
+        self._sync_index()
+        self._ask_cached.cache_clear()
         return f"Forgot PDF '{filename}' and all related memory."
 
     def list_pdfs(self):
-        conn = sqlite3.connect(self.db_path)
-        c = conn.cursor()
+        c = self._conn().cursor()
         c.execute("SELECT id, filename FROM pdf_files")
-        rows = c.fetchall()
-        conn.close()
-        return rows
+        return c.fetchall()
 
     def toggle_tts(self, enable):
-        self.tts_enabled = enable
-        return f"TTS {'enabled' if enable else 'disabled'}."
+        with self._tts_lock:
+            if self._tts_failed:
+                return "TTS unavailable."
+            self.tts_enabled = enable
+            if enable and self._tts_thread is None:
+                self._tts_thread = threading.Thread(target=self._tts_loop, daemon=True)
+                self._tts_thread.start()
+        if not enable:
+            self._drain_tts_queue()
+            return "TTS disabled."
+        self._tts_ready.wait()
+        if self._tts_failed:
+            return "TTS unavailable."
+        return "TTS enabled."
+
+    def _drain_tts_queue(self):
+        while True:
+            try:
+                self._tts_q.get_nowait()
+            except queue.Empty:
+                return
+
+    def _tts_loop(self):
+        try:
+            self.engine = pyttsx3.init()
+        except Exception:
+            with self._tts_lock:
+                self._tts_failed = True
+                self.tts_enabled = False
+            self._drain_tts_queue()
+            return
+        finally:
+            self._tts_ready.set()
+        while True:
+            text = self._tts_q.get()
+            if not self.tts_enabled:
+                continue
+            try:
+                self.engine.say(text)
+                self.engine.runAndWait()
+            except Exception:
+                pass
 
     def _speak(self, text):
         if self.tts_enabled:
-            self.engine.say(text)
-            self.engine.runAndWait()
+            self._tts_q.put_nowait(text)
+
+_ai = None
+_ai_lock = threading.Lock()
+
+def get_ai():
+    global _ai
+    if _ai is None:
+        with _ai_lock:
+            if _ai is None:
+                _ai = HybridAI()
+    return _ai
 
-ai = HybridAI()
+def _json_response(payload):
+    return Response(orjson.dumps(payload), mimetype='application/json')
 
 @app.route('/')
 def index():
@@ -164,53 +605,54 @@ def index():
 def api_ingest_pdf():
     data = request.json
     pdf_path = data.get('pdf_path')
-    result = ai.ingest_pdf(pdf_path)
-    return jsonify({'result': result})
+    use_table_mode = data.get('use_table_mode', False)
+    result = get_ai().ingest_pdf(pdf_path, use_table_mode)
+    return _json_response({'result': result})
 
 @app.route('/ask', methods=['POST'])
 def api_ask():
     data = request.json
     query = data.get('query')
-    result = ai.ask(query)
-    return jsonify({'result': result})
+    result = get_ai().ask(query)
+    return _json_response({'result': result})
 
 @app.route('/say', methods=['POST'])
 def api_say():
     data = request.json
     text = data.get('text')
-    result = ai.say(text)
-    return jsonify({'result': result})
+    result = get_ai().say(text)
+    return _json_response({'result': result})
 
 @app.route('/list_memory', methods=['GET'])
 def api_list_memory():
-    result = ai.list_memory()
-    return jsonify({'memory': result})
+    result = get_ai().list_memory()
+    return _json_response({'memory': result})
 
 @app.route('/list_pdfs', methods=['GET'])
 def api_list_pdfs():
-    result = ai.list_pdfs()
-    return jsonify({'pdfs': result})
+    result = get_ai().list_pdfs()
+    return _json_response({'pdfs': result})
 
 @app.route('/forget', methods=['POST'])
 def api_forget():
     data = request.json
     memory_id = data.get('memory_id')
-    result = ai.forget(memory_id)
-    return jsonify({'result': result})
+    result = get_ai().forget(memory_id)
+    return _json_response({'result': result})
 
 @app.route('/forget_pdf', methods=['POST'])
 def api_forget_pdf():
     data = request.json
     pdf_id = data.get('pdf_id')
-    result = ai.forget_pdf(pdf_id)
-    return jsonify({'result': result})
+    result = get_ai().forget_pdf(pdf_id)
+    return _json_response({'result': result})
 
 @app.route('/toggle_tts', methods=['POST'])
 def api_toggle_tts():
     data = request.json
     enable = data.get('enable', True)
-    result = ai.toggle_tts(enable)
-    return jsonify({'result': result})
+    result = get_ai().toggle_tts(enable)
+    return _json_response({'result': result})
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
+    app.run(host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))